@@ -33,9 +33,9 @@ with tab1:
     if uploaded_front and st.button("Extract Aadhaar Data"):
         st.info("Extracting Aadhaar data... Please wait.")
 
-        files = {"file_front": ("front.png", uploaded_front.getvalue(), "image/png")}
+        files = {"file_front": (uploaded_front.name, uploaded_front.getvalue(), uploaded_front.type)}
         if uploaded_back:
-            files["file_back"] = ("back.png", uploaded_back.getvalue(), "image/png")
+            files["file_back"] = (uploaded_back.name, uploaded_back.getvalue(), uploaded_back.type)
 
         try:
             response = requests.post("http://127.0.0.1:5000/upload_aadhaar", files=files)
@@ -113,7 +113,7 @@ with tab2:
     if uploaded_pan and st.button("Extract PAN Data"):
         st.info("Extracting PAN data... Please wait.")
 
-        files = {"file": ("pan.png", uploaded_pan.getvalue(), "image/png")}
+        files = {"file": (uploaded_pan.name, uploaded_pan.getvalue(), uploaded_pan.type)}
 
         try:
             response = requests.post("http://127.0.0.1:5000/upload_pan", files=files)
@@ -0,0 +1,67 @@
+# Benchmark the page encodings sent to the vision model, per document type.
+#
+# Usage:
+#   python benchmark_image_encoding.py "Aadhaar Card=samples/aadhaar.jpg" "Pay Slip=samples/payslip.pdf"
+#   python benchmark_image_encoding.py --api "Result=samples/result.pdf"
+#
+# For every sample it reports the base64 payload size and encoding time of each
+# format/quality below; with --api it also times one /api/generate call per page.
+import sys
+import time
+import argparse
+
+from ocr_backend_main_file import (MODEL_NAME, RASTER_SETTINGS, DEFAULT_RASTER_SETTINGS, process_file, make_api_request,
+                                   generation_options)
+
+ENCODINGS = [("PNG", None), ("JPEG", 95), ("JPEG", 85), ("JPEG", 75), ("WEBP", 85), ("WEBP", 75)]
+
+
+def benchmark(document_type, path, call_api):
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    file_ext = path.lower().split(".")[-1]
+    configured = RASTER_SETTINGS.get(document_type, DEFAULT_RASTER_SETTINGS)
+
+    for image_format, quality in ENCODINGS:
+        RASTER_SETTINGS[document_type] = {**configured, "format": image_format, "quality": quality}
+        try:
+            start = time.perf_counter()
+            pages = list(process_file(file_bytes, file_ext, document_type))
+            encode_ms = (time.perf_counter() - start) * 1000
+        finally:
+            RASTER_SETTINGS[document_type] = configured
+
+        payload_kb = sum(len(page) for page in pages) / 1024
+        api_s = ""
+        if call_api:
+            start = time.perf_counter()
+            for page in pages:
+                make_api_request({
+                    "model": MODEL_NAME,
+                    "prompt": "Extract all the text from the image.",
+                    "images": [page],
+                    "options": generation_options(document_type),
+                    "stream": False
+                })
+            api_s = f"{time.perf_counter() - start:.2f}"
+
+        label = f"{image_format} q{quality}" if quality else image_format
+        print(f"{document_type:<18} {label:<10} {len(pages):>5} {payload_kb:>12.1f} {encode_ms:>10.1f} {api_s:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare image encodings for vision model payloads")
+    parser.add_argument("samples", nargs="+", help='"<Document Type>=<path>", e.g. "PAN Card=pan.jpg"')
+    parser.add_argument("--api", action="store_true", help="also time /api/generate calls for each encoding")
+    args = parser.parse_args()
+
+    print(f"{'Document Type':<18} {'Encoding':<10} {'Pages':>5} {'Payload KB':>12} {'Encode ms':>10} {'API s':>8}")
+    for sample in args.samples:
+        if "=" not in sample:
+            sys.exit(f"Invalid sample {sample!r}, expected \"<Document Type>=<path>\"")
+        document_type, path = sample.split("=", 1)
+        benchmark(document_type, path, args.api)
+
+
+if __name__ == "__main__":
+    main()
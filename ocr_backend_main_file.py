@@ -1,11 +1,27 @@
 #working code for adhar pan and credence all pages and payslips and results
 import os
+import io
+import re
 import json
 import base64
+import hashlib
 import requests
 import time
-from flask import Flask, request, jsonify
-from pdf2image import convert_from_path
+import random
+from datetime import datetime
+import uuid
+import tempfile
+import subprocess
+import threading
+import queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from flask import Flask, Response, request, jsonify, url_for
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 
 
@@ -13,59 +29,1153 @@ app = Flask(__name__)
 
 # OCR API URL
 API_URL = "http://172.16.11.25:11434/api/generate"
+MODEL_NAME = "llama3.2-vision"
+
+# Bump whenever a prompt or the shape of a response changes, so cached results
+# and indexed classifications produced by the old prompts are no longer served
+PROMPT_VERSION = "5"
 
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Set to True to keep a copy of every Credence page under ARCHIVE_FOLDER/<request>/
+ARCHIVE_PAGES = False
+ARCHIVE_FOLDER = os.path.join(UPLOAD_FOLDER, "archive")
+
+# Longest side of the candidate photo thumbnail returned for Credence documents
+CANDIDATE_PHOTO_MAX_EDGE = 240
+
+# Number of pdftoppm processes rasterizing a PDF in parallel
+RASTER_WORKERS = min(4, os.cpu_count() or 1)
+
+# Maximum number of PDF pages rasterized and held in memory at once; each batch
+# is split across RASTER_WORKERS, so keep it at least that large
+PDF_PAGE_BATCH_SIZE = max(4, RASTER_WORKERS)
+
+# Rasterization DPI, maximum pixel edge and payload encoding per document type.
+# llama3.2-vision downsamples to at most 1120px per side internally, so anything
+# larger only inflates the payload. Classification looks for small words on page 1
+# ("Credence", "Net Pay Amount", "Hall Ticket Number") and misclassifications are
+# replayed by the classification index, so it gets the full 1120px as well; measure
+# classification accuracy on real uploads before shrinking it.
+# "format" is any PIL format (PNG, JPEG, WEBP); "quality" is ignored for PNG.
+# Run benchmark_image_encoding.py to compare sizes and latency before changing these.
+RASTER_SETTINGS = {
+    "Classification": {"dpi": 150, "max_edge": 1120, "format": "JPEG", "quality": 85},
+    "Aadhaar Card": {"dpi": 150, "max_edge": 1120, "format": "JPEG", "quality": 90},
+    "PAN Card": {"dpi": 150, "max_edge": 1120, "format": "JPEG", "quality": 90},
+    "Credence Document": {"dpi": 100, "max_edge": 1120, "format": "JPEG", "quality": 85},
+    "Pay Slip": {"dpi": 100, "max_edge": 1120, "format": "JPEG", "quality": 85},
+    "Result": {"dpi": 100, "max_edge": 1120, "format": "JPEG", "quality": 85},
+}
+DEFAULT_RASTER_SETTINGS = {"dpi": 100, "max_edge": 1120, "format": "PNG", "quality": None}
+
+# Maximum number of per-page /api/generate calls in flight for one document
+MAX_CONCURRENT_PAGE_REQUESTS = 4
+
+# Calls per second allowed to the model API across all requests in this process,
+# and how many may be sent back to back after an idle period. 0 disables the limit.
+API_RATE_LIMIT_PER_SECOND = 2.0
+API_RATE_LIMIT_BURST = 4
+
+# Maximum number of extraction calls made for an Aadhaar/PAN card. The first call
+# is accepted as soon as every field passes ID_CARD_FIELD_VALIDATORS; otherwise the
+# remaining samples are drawn in parallel, asking only for the fields that failed,
+# and the answers are merged field by field. The first call decodes greedily; the
+# others sample at ID_CARD_SAMPLE_TEMPERATURE with a seed each, so they can differ.
+ID_CARD_SAMPLES = 3
+ID_CARD_SAMPLE_TEMPERATURE = 0.5
+
+# Classify and extract in one call: the first page is rendered with the ID-card
+# RASTER_SETTINGS and a single prompt returns its document type together with the
+# REQUIRED_KEYS fields, which become the first ID-card sample. Saves a model
+# round-trip per Aadhaar/PAN upload; other types still run their own extraction.
+ID_CARD_COMBINED_MODE = False
+
+# Speculative ID-card extraction: for single-image uploads the Aadhaar/PAN
+# extraction call is sent on one of SPECULATION_WORKERS threads at the same time
+# as the classification call. Its answer is used when the upload turns out to be
+# an ID card and discarded otherwise, trading model time on other document types
+# for ID-card latency. Outcomes are counted under /speculation/stats.
+SPECULATIVE_ID_CARD_EXTRACTION = False
+SPECULATION_WORKERS = 4
+
+# Keep-alive connections to the model server, shared by all requests in this
+# process. Size the pool for every call that can be in flight at once: page
+# workers and ID-card samples across concurrently served requests.
+API_POOL_SIZE = 16
+# Seconds a call waits for a free pooled connection before failing like a timeout
+API_POOL_TIMEOUT = 30
+# Seconds to wait for a connection to the model server, and for its answer
+API_CONNECT_TIMEOUT = 5
+API_READ_TIMEOUT = 120
+
+# Transient model API failures (connection errors, timeouts, 429 and 5xx) are
+# retried up to API_MAX_RETRIES times with exponential backoff and full jitter.
+# A call, retries included, never runs longer than API_CALL_DEADLINE seconds.
+API_MAX_RETRIES = 3
+API_BACKOFF_BASE = 0.5
+API_BACKOFF_MAX = 8
+API_CALL_DEADLINE = 240
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# After CIRCUIT_FAILURE_THRESHOLD consecutive failed attempts the model API is
+# considered down: /ocr fails fast for CIRCUIT_RESET_TIMEOUT seconds, then a
+# single probe call decides whether the circuit closes again.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+
+# Ollama unloads a model after its keep_alive has passed without calls (5 minutes
+# by default), and the next call pays the full load time. Every call asks the
+# server to keep the model loaded for MODEL_KEEP_ALIVE (-1 keeps it loaded
+# indefinitely). Once start_model_warmer() has been called, MODEL_NAME and
+# TEXT_MODEL_NAME are loaded and loaded again after KEEP_WARM_INTERVAL seconds
+# without a model call (0 disables the background ping); a load may take up to
+# MODEL_LOAD_TIMEOUT seconds. Importing this module never contacts the model
+# server: `python ocr_backend_main_file.py` starts the warmer itself, and a WSGI
+# server has to start it in each worker, e.g. gunicorn's post_fork hook:
+#     def post_fork(server, worker):
+#         import ocr_backend_main_file
+#         ocr_backend_main_file.start_model_warmer()
+MODEL_KEEP_ALIVE = "30m"
+KEEP_WARM_INTERVAL = 20 * 60
+MODEL_LOAD_TIMEOUT = 300
+
+# Cache of complete /ocr results keyed by the uploaded bytes, MODEL_NAME and
+# PROMPT_VERSION: RESULT_CACHE_SIZE entries in memory, plus an optional disk tier
+# in RESULT_CACHE_DIR (None disables it) capped at RESULT_CACHE_MAX_BYTES.
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_DIR = None
+RESULT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Cache of single-page extraction answers (Credence, Pay Slip, Result) keyed by
+# the rendered page and the rest of the request (model, prompt, output schema and
+# generation options), so a resubmitted bundle only pays for the pages that
+# changed. Same tiers as the result cache.
+PAGE_CACHE_SIZE = 2048
+PAGE_CACHE_DIR = None
+PAGE_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# First pages whose perceptual hash is within CLASSIFICATION_MAX_DISTANCE (fraction
+# of differing hash bits) of an already classified page reuse its document type
+# without a model call. The index is kept in CLASSIFICATION_INDEX_PATH across
+# restarts and discarded when MODEL_NAME or PROMPT_VERSION changes; set
+# CLASSIFICATION_INDEX_PATH to None to always ask the model.
+CLASSIFICATION_INDEX_PATH = os.path.join(UPLOAD_FOLDER, "classification_index.json")
+CLASSIFICATION_HASH_SIZE = 8
+CLASSIFICATION_MAX_DISTANCE = 0.1
+CLASSIFICATION_INDEX_SIZE = 1000
+
+# Digitally generated PDFs (most payslips, many results) carry a text layer.
+# Pages whose text layer has at least TEXT_LAYER_MIN_CHARS characters skip
+# rasterization and are sent to TEXT_MODEL_NAME as text-only prompts; the
+# document type is then also read from the text of page 1 when the keywords of
+# only one type appear in it. TEXT_MODEL_NAME can point at a smaller text-only model.
+TEXT_LAYER_ENABLED = True
+TEXT_LAYER_MIN_CHARS = 200
+TEXT_MODEL_NAME = MODEL_NAME
+
+# Keywords identifying each document type in a page's text layer. Credence wins
+# outright, as in the classification prompt; any other overlap (payslips and
+# marks memos print "Aadhaar No" or a Permanent Account Number) is left to the
+# vision classifier.
+TEXT_LAYER_KEYWORDS = [
+    ("Credence Document", ["credence"]),
+    ("Aadhaar Card", ["aadhaar", "uidai", "unique identification"]),
+    ("PAN Card", ["income tax department", "permanent account number"]),
+    ("Pay Slip", ["pay slip", "payslip", "salary statement", "net pay"]),
+    ("Result", ["marks", "grade", "hall ticket", "roll no", "university"]),
+]
+
 # Required keys
 REQUIRED_KEYS = ["documentType", "documentNumber", "dateOfBirthorIssue", "FatherGuardianName", "nameAsOnDoc", "Gender", "Address"]
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-
-def pdf_to_images(pdf_path):
-    return convert_from_path(pdf_path)
+# Markdown label and instructions for each key, used when asking again for specific fields
+ID_CARD_FIELD_PROMPTS = {
+    "documentType": "**Document Type:** (Aadhaar card or PAN card)",
+    "documentNumber": "**Document Number:** (aadhaar card or pan card number)",
+    "dateOfBirthorIssue": "**Date of Birth/Issue:** (show in date formats it could be DOB)",
+    "nameAsOnDoc": "**Name as on Document:** (first line of name)",
+    "FatherGuardianName": "**Father's/Guardian's Name:** (Father's Name line directly below the Name)",
+    "Gender": "**Gender:** (Male, Female or Transgender)",
+    "Address": "**Address:** (show only address if it is here not any sentences and if not address then show only N/A)",
+}
+
+# With STRUCTURED_OUTPUT every extraction call passes the document type's
+# OUTPUT_SCHEMAS entry as Ollama's format option (Ollama 0.5+), so the model can
+# only answer with JSON of that shape; the answers are returned as parsed
+# objects instead of free text. Set to False for servers without schema support.
+STRUCTURED_OUTPUT = True
+
+ID_CARD_SCHEMA = {
+    "type": "object",
+    "properties": {key: {"type": "string"} for key in REQUIRED_KEYS},
+    "required": REQUIRED_KEYS,
+}
+PAYSLIP_FIELDS = [
+    "month", "employeeName", "employeeCode", "designation", "panNumber", "department", "cityFacility",
+    "dateOfJoining", "totalDays", "payableDays", "lopDays", "basic", "hra", "otherAllowances",
+    "conveyanceAllowance", "medicalAllowance", "grossEarnings", "totalDeductions", "netPayAmount", "netPayInWords",
+]
+RESULT_SUBJECT_FIELDS = ["subject", "marksObtained", "maximumMarks", "grade", "resultStatus"]
+RESULT_FIELDS = [
+    "studentName", "rollNumber", "hallTicketNumber", "yearOfAdmission", "collegeName",
+    "finalExamMonthYear", "classAwarded", "aggregateMarks", "resultStatus",
+]
+OUTPUT_SCHEMAS = {
+    "Aadhaar Card": ID_CARD_SCHEMA,
+    "PAN Card": ID_CARD_SCHEMA,
+    "Credence Document": {
+        "type": "object",
+        "properties": {
+            "fields": {"type": "array", "items": {
+                "type": "object",
+                "properties": {"label": {"type": "string"}, "value": {"type": "string"}},
+                "required": ["label", "value"],
+            }},
+            "sections": {"type": "array", "items": {
+                "type": "object",
+                "properties": {"heading": {"type": "string"}, "text": {"type": "string"}},
+                "required": ["heading", "text"],
+            }},
+        },
+        "required": ["fields", "sections"],
+    },
+    "Pay Slip": {
+        "type": "object",
+        "properties": {
+            "payslips": {"type": "array", "items": {
+                "type": "object",
+                "properties": {field: {"type": "string"} for field in PAYSLIP_FIELDS},
+                "required": PAYSLIP_FIELDS,
+            }},
+        },
+        "required": ["payslips"],
+    },
+    "Result": {
+        "type": "object",
+        "properties": {
+            **{field: {"type": "string"} for field in RESULT_FIELDS},
+            "semesters": {"type": "array", "items": {
+                "type": "object",
+                "properties": {
+                    "semester": {"type": "string"},
+                    "subjects": {"type": "array", "items": {
+                        "type": "object",
+                        "properties": {field: {"type": "string"} for field in RESULT_SUBJECT_FIELDS},
+                        "required": RESULT_SUBJECT_FIELDS,
+                    }},
+                },
+                "required": ["semester", "subjects"],
+            }},
+        },
+        "required": RESULT_FIELDS + ["semesters"],
+    },
+}
+
+# Labels the classification answers are constrained to (classify_with_model and
+# classify_and_extract) and the document type each one means
+CLASSIFICATION_LABELS = {
+    "Aadhaar Card": "Aadhaar Card",
+    "PAN Card": "PAN Card",
+    "Credence": "Credence Document",
+    "Pay Slip": "Pay Slip",
+    "result": "Result",
+}
+
+# Ollama generation options per call type, sent in every payload's "options"
+# together with temperature 0: num_predict caps the answer's tokens, num_ctx the
+# context window (prompt, PDF text layer and answer), and stop ends free-text
+# answers early. Answers cut off by num_predict are reported as truncated.
+GENERATION_OPTIONS = {
+    "Classification": {"num_predict": 24, "num_ctx": 1024},
+    "Aadhaar Card": {"num_predict": 384, "num_ctx": 2048},
+    "PAN Card": {"num_predict": 384, "num_ctx": 2048},
+    "Credence Document": {"num_predict": 2048, "num_ctx": 8192, "stop": ["\nNote:", "\n**Note:**"]},
+    "Pay Slip": {"num_predict": 1536, "num_ctx": 8192, "stop": ["\nNote:", "\n**Note:**"]},
+    "Result": {"num_predict": 3072, "num_ctx": 8192, "stop": ["\nNote:", "\n**Note:**"]},
+}
+DEFAULT_GENERATION_OPTIONS = {"num_predict": 2048, "num_ctx": 8192}
+
+# Values the model uses for a field it could not read
+MISSING_VALUES = ["NA", "Not available", "N/A", "Not Visible"]
+
+GENDER_VALUES = {"male", "female", "transgender", "other"}
+DATE_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d", "%d %B %Y", "%d %b %Y"]
+
+# Verhoeff multiplication and permutation tables, used by the Aadhaar checksum
+VERHOEFF_D = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 2, 3, 4, 0, 6, 7, 8, 9, 5],
+    [2, 3, 4, 0, 1, 7, 8, 9, 5, 6], [3, 4, 0, 1, 2, 8, 9, 5, 6, 7],
+    [4, 0, 1, 2, 3, 9, 5, 6, 7, 8], [5, 9, 8, 7, 6, 0, 4, 3, 2, 1],
+    [6, 5, 9, 8, 7, 1, 0, 4, 3, 2], [7, 6, 5, 9, 8, 2, 1, 0, 4, 3],
+    [8, 7, 6, 5, 9, 3, 2, 1, 0, 4], [9, 8, 7, 6, 5, 4, 3, 2, 1, 0],
+]
+VERHOEFF_P = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 5, 7, 6, 2, 8, 3, 0, 9, 4],
+    [5, 8, 0, 3, 7, 9, 6, 2, 4, 1], [8, 9, 1, 6, 0, 4, 3, 5, 2, 7],
+    [9, 4, 5, 3, 1, 2, 6, 8, 7, 0], [4, 2, 8, 6, 5, 7, 3, 9, 0, 1],
+    [2, 7, 9, 3, 8, 0, 6, 4, 1, 5], [7, 0, 4, 6, 9, 1, 3, 2, 5, 8],
+]
+
+def encode_image_bytes(image_bytes):
+    return base64.b64encode(image_bytes).decode("utf-8")
+
+def encode_pil_image(img, image_format="PNG", quality=None):
+    """Encode a PIL image as base64 in image_format without touching the disk."""
+    buffer = io.BytesIO()
+    if image_format == "PNG":
+        img.save(buffer, "PNG")
+    else:
+        if image_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")  # JPEG has no alpha or palette modes
+        img.save(buffer, image_format, quality=quality or 85)
+    return encode_image_bytes(buffer.getvalue())
+
+def downscale_image(img, max_edge):
+    """Shrink img in place so its longest side is at most max_edge pixels."""
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return img
+
+@contextmanager
+def spooled_pdf(pdf_bytes):
+    """poppler needs a file path; spool the upload once to the OS temp directory."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "upload.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(pdf_bytes)
+        yield pdf_path
+
+def page_runs(page_numbers, max_length):
+    """Group sorted page numbers into [first, last] runs of consecutive pages, at most max_length long."""
+    runs = []
+    for page_number in page_numbers:
+        if runs and page_number == runs[-1][1] + 1 and page_number - runs[-1][0] < max_length:
+            runs[-1][1] = page_number
+        else:
+            runs.append([page_number, page_number])
+    return runs
+
+def pdf_to_images(pdf_bytes, dpi=200, page_numbers=None, batch_size=PDF_PAGE_BATCH_SIZE, workers=RASTER_WORKERS):
+    """Yield pages of a PDF as PIL images, in order, rasterizing batch_size pages at a time.
+
+    page_numbers (1-based, sorted) limits rendering to those pages; by default all
+    pages are rendered. Each batch is split across up to workers pdftoppm processes.
+    """
+    with spooled_pdf(pdf_bytes) as pdf_path:
+        page_count = pdfinfo_from_path(pdf_path)["Pages"]
+        if page_numbers is None:
+            page_numbers = range(1, page_count + 1)
+        page_numbers = [page_number for page_number in page_numbers if page_number <= page_count]
+
+        for first, last in page_runs(page_numbers, batch_size):
+            yield from convert_from_path(
+                pdf_path, dpi=dpi, first_page=first, last_page=last,
+                thread_count=min(workers, last - first + 1)
+            )
+
+def count_pages(file_bytes, file_ext):
+    """Number of pages process_file will yield for the upload."""
+    if file_ext != "pdf":
+        return 1
+    with spooled_pdf(file_bytes) as pdf_path:
+        return pdfinfo_from_path(pdf_path)["Pages"]
+
+def read_text_layer(pdf_bytes):
+    """Per-page text of a PDF's embedded text layer; None for pages without usable text.
+
+    Returns an empty list when the text layer cannot be read at all.
+    """
+    with spooled_pdf(pdf_bytes) as pdf_path:
+        try:
+            result = subprocess.run(["pdftotext", "-layout", "-enc", "UTF-8", pdf_path, "-"],
+                                    capture_output=True, timeout=60)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"Could not read PDF text layer: {e}")
+            return []
+    if result.returncode != 0:
+        return []
+
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    if pages and not pages[-1].strip():
+        pages.pop()  # pdftotext ends every page, including the last, with a form feed
+    return [text.strip() if len(text.strip()) >= TEXT_LAYER_MIN_CHARS else None for text in pages]
+
+def classify_text(text):
+    """Document type named by the keywords in a page's text, or None unless exactly one type matches."""
+    text = text.lower()
+    matches = [document_type for document_type, keywords in TEXT_LAYER_KEYWORDS
+               if any(keyword in text for keyword in keywords)]
+    if "Credence Document" in matches:
+        return "Credence Document"
+    return matches[0] if len(matches) == 1 else None
+
+class ResultCache:
+    """Thread-safe LRU cache of JSON-serialisable values with an optional size-capped disk tier.
+
+    Disk entries are written atomically, so several worker processes can share
+    disk_dir; the least recently used files are removed once it grows past
+    max_disk_bytes.
+    """
+
+    def __init__(self, max_entries, disk_dir=None, max_disk_bytes=0):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        value = self.read_disk(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self.store(key, value)
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.store(key, value)
+        if self.disk_dir:
+            self.write_disk(key, value)
+
+    def store(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self.disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)  # Modification time doubles as the disk tier's LRU order
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def write_disk(self, key, value):
+        path = self.disk_path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write cache entry {key}: {e}")
+            return
+        self.evict_disk()
+
+    def evict_disk(self):
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # Removed by another process
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_size <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
 
-def process_file(file):
-    images_base64 = []
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+page_cache = ResultCache(PAGE_CACHE_SIZE, PAGE_CACHE_DIR, PAGE_CACHE_MAX_BYTES)
+
+
+def perceptual_hash(image_base64, hash_size=CLASSIFICATION_HASH_SIZE):
+    """Difference hash: one bit per pair of neighbouring pixels in a small grayscale copy."""
+    image = Image.open(io.BytesIO(base64.b64decode(image_base64))).convert("L")
+    pixels = list(image.resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+class ClassificationIndex:
+    """Perceptual hashes of classified first pages and their document types, saved as JSON."""
+
+    def __init__(self, path, max_distance, max_entries, hash_size=CLASSIFICATION_HASH_SIZE):
+        self.path = path
+        self.hash_size = hash_size
+        self.max_bits = int(max_distance * hash_size * hash_size)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.entries = self.load()
+
+    def load(self):
+        if not self.path:
+            return []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["hashSize"] != self.hash_size:
+                return []  # Hashes of a different size are not comparable
+            if data.get("model") != MODEL_NAME or data.get("promptVersion") != PROMPT_VERSION:
+                return []  # Answers of another model or prompt, possibly wrong ones, are not replayed
+            return [(int(entry["hash"], 16), entry["documentType"]) for entry in data["entries"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return []
+
+    def save(self):
+        data = {
+            "hashSize": self.hash_size,
+            "model": MODEL_NAME,
+            "promptVersion": PROMPT_VERSION,
+            "entries": [{"hash": format(image_hash, "x"), "documentType": document_type}
+                        for image_hash, document_type in self.entries]
+        }
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save classification index: {e}")
+
+    def lookup(self, image_hash):
+        """Document type of the closest indexed page within the distance threshold, or None."""
+        with self.lock:
+            best_type, best_distance = None, self.max_bits + 1
+            for indexed_hash, document_type in self.entries:
+                distance = bin(indexed_hash ^ image_hash).count("1")
+                if distance < best_distance:
+                    best_type, best_distance = document_type, distance
+            if best_type:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return best_type
+
+    def add(self, image_hash, document_type):
+        if not self.path:
+            return
+        with self.lock:
+            # Pick up pages other worker processes have added since we loaded
+            known = set(self.entries)
+            self.entries += [entry for entry in self.load() if entry not in known]
+            self.entries.append((image_hash, document_type))
+            self.entries = self.entries[-self.max_entries:]
+            self.save()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+classification_index = ClassificationIndex(CLASSIFICATION_INDEX_PATH, CLASSIFICATION_MAX_DISTANCE, CLASSIFICATION_INDEX_SIZE)
+
+def result_cache_key(file_bytes):
+    digest = hashlib.sha256(file_bytes)
+    digest.update(f"|{MODEL_NAME}|{PROMPT_VERSION}|{STRUCTURED_OUTPUT}".encode("utf-8"))
+    return digest.hexdigest()
+
+def page_cache_key(page_content, payload):
+    digest = hashlib.sha256(page_content.encode("utf-8"))
+    request_fields = {key: value for key, value in payload.items() if key not in ["images", "stream"]}
+    digest.update(json.dumps(request_fields, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_upload(file):
+    """Return the upload's bytes and lower-case extension, kept in memory."""
     file_ext = file.filename.lower().split(".")[-1]
-    file_path = f"temp_upload.{file_ext}"
-    file.save(file_path)
-    
+    return file.read(), file_ext
+
+def process_file(file_bytes, file_ext, document_type=None, page_numbers=None):
+    """Yield each page of the upload as a base64 image, as soon as it is rasterized.
+
+    Pages are rendered and downscaled with the RASTER_SETTINGS of document_type;
+    page_numbers limits which PDF pages are rendered.
+    """
+    settings = RASTER_SETTINGS.get(document_type, DEFAULT_RASTER_SETTINGS)
+
+    image_format, quality = settings["format"], settings["quality"]
+
     if file_ext == "pdf":
-        images = pdf_to_images(file_path)
-        for i, img in enumerate(images):
-            img_path = f"temp_page_{i}.png"
-            img.save(img_path, "PNG")
-            images_base64.append(encode_image(img_path))
-            os.remove(img_path)
+        for img in pdf_to_images(file_bytes, dpi=settings["dpi"], page_numbers=page_numbers):
+            yield encode_pil_image(downscale_image(img, settings["max_edge"]), image_format, quality)
     else:
-        images_base64.append(encode_image(file_path))
-    
-    os.remove(file_path)
-    return images_base64
+        img = Image.open(io.BytesIO(file_bytes))
+        if max(img.size) <= settings["max_edge"] and img.format == image_format:
+            yield encode_image_bytes(file_bytes)  # Already small enough, send as uploaded
+        else:
+            yield encode_pil_image(downscale_image(img, settings["max_edge"]), image_format, quality)
 
-def save_image(base64_string, filename):
+def save_image(base64_string, filename, folder):
     """Save a base64 string as an image file."""
     image_data = base64.b64decode(base64_string)  # Decode the base64 string
-    image_path = os.path.join(UPLOAD_FOLDER, filename)
+    image_path = os.path.join(folder, filename)
     
     with open(image_path, "wb") as f:
         f.write(image_data)  # Write image file
     
     return image_path
 
-
-
-def make_api_request(payload):
-    headers = {"Content-Type": "application/json"}
-    response = requests.post(API_URL, json=payload, headers=headers, verify=False)
+def archive_page(base64_string, page_number, document_type, request_id):
+    """Persist a page under ARCHIVE_FOLDER, grouped by request."""
+    request_folder = os.path.join(ARCHIVE_FOLDER, request_id)
+    os.makedirs(request_folder, exist_ok=True)
+    image_format = RASTER_SETTINGS.get(document_type, DEFAULT_RASTER_SETTINGS)["format"]
+    extension = "jpg" if image_format == "JPEG" else image_format.lower()
+    return save_image(base64_string, f"page_{page_number}.{extension}", request_folder)
+
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks only when the bucket is empty."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Shared by every request handled by this process
+api_rate_limiter = TokenBucket(API_RATE_LIMIT_PER_SECOND, API_RATE_LIMIT_BURST)
+
+
+class ModelBackendUnavailable(Exception):
+    """The model API is unreachable, or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Thread-safe closed / open / half-open circuit breaker."""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        """True while calls are being rejected, without claiming the recovery probe."""
+        with self.lock:
+            if self.state == "open":
+                return time.monotonic() - self.opened_at < self.reset_timeout
+            return self.state == "half_open"
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"  # This caller becomes the recovery probe
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def release_probe(self):
+        """Let another caller probe when this one never reached the backend."""
+        with self.lock:
+            if self.state == "half_open":
+                self.state = "open"  # opened_at is unchanged, so the next caller probes at once
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Model API circuit opened after {self.failures} consecutive failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+# Shared by every request handled by this process
+api_circuit_breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+
+
+# Both pools override urllib3's private _get_conn(timeout), relying on urllib3 2.x
+# (2.8 here): HTTPConnectionPool.urlopen calls self._get_conn(timeout=pool_timeout),
+# and requests' HTTPAdapter.send never passes pool_timeout, so it arrives as None,
+# which a blocking pool treats as "wait forever". Recheck on a urllib3 upgrade.
+class BoundedWaitHTTPConnectionPool(HTTPConnectionPool):
+    """Blocking pool that gives up after API_POOL_TIMEOUT seconds instead of waiting forever."""
+
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(API_POOL_TIMEOUT if timeout is None else timeout)
+
+class BoundedWaitHTTPSConnectionPool(HTTPSConnectionPool):
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(API_POOL_TIMEOUT if timeout is None else timeout)
+
+def create_api_session():
+    """Session with a keep-alive connection pool; urllib3's pool is safe to share across threads."""
+    session = requests.Session()
+    # pool_block makes callers wait for a free connection instead of opening throwaway ones
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_SIZE, pool_block=True)
+    # requests has no pool timeout setting, so a leaked connection would block callers forever
+    adapter.poolmanager.pool_classes_by_scheme = {
+        "http": BoundedWaitHTTPConnectionPool,
+        "https": BoundedWaitHTTPSConnectionPool,
+    }
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    session.verify = False
+    return session
+
+api_session = create_api_session()
+last_model_activity = time.monotonic()  # Last call sent to the model server, for the keep-warm ping
+
+
+def release_response(response):
+    """Read the rest of a streamed body and hand its connection back to the pool.
+
+    The body is cached on the response, so .text still works afterwards.
+    """
+    try:
+        response.content
+    except requests.exceptions.RequestException:
+        pass  # The connection is discarded by close() instead
+    finally:
+        response.close()
     return response
 
+def make_api_request(payload, stream=False):
+    """POST payload to the model API, retrying transient failures within API_CALL_DEADLINE.
+
+    Returns the last response when retries run out on an HTTP error status, and
+    raises ModelBackendUnavailable when no response could be obtained at all.
+    With stream=True the body is left unread for the caller to iterate.
+    """
+    global last_model_activity
+    payload = {"keep_alive": MODEL_KEEP_ALIVE, **payload}
+    deadline = time.monotonic() + API_CALL_DEADLINE
+    response = None
+    error = None
+    for attempt in range(API_MAX_RETRIES + 1):
+        if not api_circuit_breaker.allow_request():
+            raise ModelBackendUnavailable("Model API is unavailable (circuit breaker open)")
+        api_rate_limiter.acquire()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        last_model_activity = time.monotonic()
+        try:
+            response = api_session.post(API_URL, json=payload, stream=stream,
+                                        timeout=(API_CONNECT_TIMEOUT, min(API_READ_TIMEOUT, remaining)))
+        except EmptyPoolError as e:
+            # Every pooled connection is busy: this process is loaded, which says
+            # nothing about the backend, so retry without counting a failure
+            api_circuit_breaker.release_probe()
+            error = str(e)
+        except requests.exceptions.RequestException as e:
+            # Refused connections, timeouts and bodies cut off mid-read are worth a retry
+            api_circuit_breaker.record_failure()
+            error = str(e)
+        except Exception:
+            api_circuit_breaker.record_failure()  # A half-open probe must always record an outcome
+            raise
+        else:
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                api_circuit_breaker.record_success()
+                return response
+            api_circuit_breaker.record_failure()
+            error = f"status code {response.status_code}"
+            release_response(response)  # An unread stream would hold its pooled connection
+
+        # Full jitter keeps concurrent page workers from retrying in lockstep
+        delay = random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2 ** attempt))
+        if attempt == API_MAX_RETRIES or time.monotonic() + delay >= deadline:
+            break
+        print(f"Model API attempt {attempt + 1} failed ({error}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+    if response is not None:
+        return response  # Callers report the final status code as before
+    raise ModelBackendUnavailable(f"Model API request failed: {error}")
+
+
+class RebuiltResponse:
+    """The parts of requests.Response the extraction code reads, rebuilt from a token stream or cache."""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.text = json.dumps(body)
+
+    def json(self):
+        return self.body
+
+def make_streaming_api_request(payload, on_token):
+    """Call the model with Ollama streaming on, passing each token to on_token as it arrives."""
+    response = make_api_request({**payload, "stream": True}, stream=True)
+    if response.status_code != 200:
+        return release_response(response)
+
+    tokens = []
+    final_chunk = {}
+    with response:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("response"):
+                tokens.append(chunk["response"])
+                on_token(chunk["response"])
+            if chunk.get("done"):
+                final_chunk = chunk
+    return RebuiltResponse(200, {**final_chunk, "response": "".join(tokens)})
+
+
+def configured_models():
+    return list(dict.fromkeys([MODEL_NAME, TEXT_MODEL_NAME]))
+
+def warm_models():
+    """Load the configured models with an empty generate call, which only loads the model."""
+    global last_model_activity
+    for model_name in configured_models():
+        start = time.monotonic()
+        last_model_activity = start
+        try:
+            response = api_session.post(API_URL, json={"model": model_name, "keep_alive": MODEL_KEEP_ALIVE},
+                                        timeout=(API_CONNECT_TIMEOUT, MODEL_LOAD_TIMEOUT))
+            print(f"Warmed {model_name} in {time.monotonic() - start:.1f}s (status code {response.status_code})")
+        except requests.exceptions.RequestException as e:
+            print(f"Could not warm {model_name}: {e}")
+
+def keep_models_warm():
+    """Warm the models now, then again whenever the model server was idle for KEEP_WARM_INTERVAL seconds."""
+    warm_models()
+    while KEEP_WARM_INTERVAL > 0:
+        idle = time.monotonic() - last_model_activity
+        if idle < KEEP_WARM_INTERVAL:
+            time.sleep(KEEP_WARM_INTERVAL - idle)
+        else:
+            warm_models()
+
+model_warmer = None
+
+def start_model_warmer():
+    """Start the keep-warm thread of this process, once; call it where requests are served."""
+    global model_warmer
+    if model_warmer is None or not model_warmer.is_alive():
+        model_warmer = threading.Thread(target=keep_models_warm, name="model-warmer", daemon=True)
+        model_warmer.start()
+
+
+def is_valid_aadhaar_number(value):
+    """12 digits, not starting with 0 or 1, with a valid Verhoeff check digit."""
+    digits = re.sub(r"[\s-]", "", value)
+    if not re.fullmatch(r"[2-9][0-9]{11}", digits):
+        return False
+    checksum = 0
+    for i, digit in enumerate(reversed(digits)):
+        checksum = VERHOEFF_D[checksum][VERHOEFF_P[i % 8][int(digit)]]
+    return checksum == 0
+
+def is_valid_pan_number(value):
+    return re.fullmatch(r"[A-Z]{5}[0-9]{4}[A-Z]", value.replace(" ", "").upper()) is not None
+
+def is_valid_date(value):
+    value = value.strip()
+    if re.fullmatch(r"(19|20)[0-9]{2}", value):  # Older Aadhaar cards only print the year of birth
+        return True
+    for date_format in DATE_FORMATS:
+        try:
+            datetime.strptime(value, date_format)
+            return True
+        except ValueError:
+            continue
+    return False
+
+def is_valid_gender(value):
+    # Aadhaar prints the gender bilingually, e.g. "पुरुष / MALE"
+    return value.split("/")[-1].strip().lower() in GENDER_VALUES
+
+def is_present(value):
+    return value not in MISSING_VALUES and any(c.isalpha() for c in value)
+
+# Fields that must pass validation before an ID-card extraction is accepted
+ID_CARD_FIELD_VALIDATORS = {
+    "Aadhaar Card": {
+        "documentNumber": is_valid_aadhaar_number,
+        "dateOfBirthorIssue": is_valid_date,
+        "Gender": is_valid_gender,
+        "nameAsOnDoc": is_present,
+    },
+    "PAN Card": {
+        "documentNumber": is_valid_pan_number,
+        "dateOfBirthorIssue": is_valid_date,
+        "nameAsOnDoc": is_present,
+        "FatherGuardianName": is_present,
+    },
+}
+
+def build_id_card_prompt(fields):
+    """Extraction prompt asking only for the given REQUIRED_KEYS fields."""
+    return (
+        "Act as an OCR assistant. Analyze the provided (PDF or image) and extract only the following details,"
+        " one per line, using exactly these labels:\n"
+        + "\n".join(ID_CARD_FIELD_PROMPTS[field] for field in fields)
+        + "\nIf any field is missing, return 'NA' for that field."
+    )
+
+def with_output_schema(payload, output_schema):
+    """Constrain the payload's answer to JSON matching output_schema when STRUCTURED_OUTPUT is on."""
+    if STRUCTURED_OUTPUT and output_schema:
+        payload["format"] = output_schema
+    return payload
+
+def generation_options(call_type):
+    """Ollama options for a call_type from GENERATION_OPTIONS, with deterministic sampling."""
+    return {"temperature": 0.0, **GENERATION_OPTIONS.get(call_type, DEFAULT_GENERATION_OPTIONS)}
+
+def is_truncated(response):
+    """Whether the model stopped because the answer reached num_predict."""
+    try:
+        return response.json().get("done_reason") == "length"
+    except ValueError:
+        return False
+
+truncation_stats = {}  # Answers cut off at num_predict, per call type, for /model/status
+truncation_lock = threading.Lock()
+
+def record_truncation(call_type):
+    """Count an answer of call_type that stopped at num_predict."""
+    with truncation_lock:
+        truncation_stats[call_type] = truncation_stats.get(call_type, 0) + 1
+
+def parse_structured_answer(answer):
+    """Parse a JSON answer requested with STRUCTURED_OUTPUT; anything else is returned as text."""
+    if STRUCTURED_OUTPUT:
+        try:
+            return json.loads(answer)
+        except ValueError:
+            print("Model answer is not valid JSON, keeping it as text")
+    return answer
+
+def id_card_extraction_payload(images_base64, document_type="Aadhaar Card"):
+    """Payload of the first Aadhaar/PAN extraction call, asking for every field."""
+    prompt_text = (
+            "Act as an OCR assistant. Analyze the provided (PDF or image) and return the extracted fields in JSON format."
+            "Extract the following details if present in the (PDF or image):"
+            "Document Type(if it is aadhaar card then show Aadhaar card if it is pan card then show PAN card)"
+            "Document Number(aadhard card or pan card number)"
+            "Date of Birth/Issue(show in date formats it could be DOB)"
+            "Name as on Document(first line of name)"
+            "Father's/Guardian's Name(Father's Name line directly below the Name)"
+            "Gender, and Address(show only address if it is here not any sentences and if not address"
+            "then show only N/A)"
+            "If any field is missing, return 'NA' for that field."
+            "from extracted details I want only specific information"
+    )
+    return with_output_schema({
+        "model": MODEL_NAME,
+        "prompt": prompt_text,
+        "images": images_base64,
+        "options": generation_options(document_type),
+        "stream": False
+    }, ID_CARD_SCHEMA)
+
+def id_card_schema(fields):
+    """ID_CARD_SCHEMA narrowed to the given REQUIRED_KEYS fields."""
+    return {
+        "type": "object",
+        "properties": {field: ID_CARD_SCHEMA["properties"][field] for field in fields},
+        "required": list(fields),
+    }
 
-def crop_candidate_photo(image_path):
-    image = Image.open(image_path)
+def build_classify_and_extract_prompt():
+    """Prompt that classifies the page and, for Aadhaar/PAN cards, also asks for every REQUIRED_KEYS field."""
+    return (
+        "Act as an OCR assistant. First decide which of these the provided image is:"
+        " 'Aadhaar Card' (words like \"Aadhaar\", \"Unique Identification\", \"UIDAI\"),"
+        " 'PAN Card' (words like \"Income Tax Department\", \"Permanent Account Number\"),"
+        " 'Credence' (the word 'Credence' anywhere on the page, takes precedence over the others),"
+        " 'Pay Slip' (words like 'Pay Slip', 'Salary Statement', 'Net Pay Amount') or"
+        " 'result' (words like 'Marks', 'grade', 'Hall Ticket Number', 'Roll No', 'University').\n"
+        "Answer on the first line with **Category:** followed by exactly one of these five options.\n"
+        "Only if it is an Aadhaar Card or PAN Card, then extract the following details, one per line,"
+        " using exactly these labels:\n"
+        + "\n".join(ID_CARD_FIELD_PROMPTS[field] for field in REQUIRED_KEYS)
+        + "\nIf any field is missing, return 'NA' for that field."
+    )
+
+def parse_id_card_response(extracted_text):
+    """Pull REQUIRED_KEYS out of the model's JSON or markdown answer; missing fields become "NA"."""
+    extracted_data = {}
+    structured = parse_structured_answer(extracted_text)
+
+    if isinstance(structured, dict):
+        for key in REQUIRED_KEYS:
+            if structured.get(key) is not None:
+                extracted_data[key] = str(structured[key]).strip()
+    else:
+        for line in extracted_text.split("\n"):
+            if "**Document Type:**" in line:
+                extracted_data["documentType"] = line.split(":")[-1].lstrip("*").strip()
+            elif "**Document Number:**" in line:
+                extracted_data["documentNumber"] = line.split(":")[-1].lstrip("*").strip()
+            elif "**Date of Birth/Issue:**" in line:
+                extracted_data["dateOfBirthorIssue"] = line.split(":")[-1].lstrip("*").strip()
+            elif "**Father's/Guardian's Name:**" in line:
+                extracted_data["FatherGuardianName"] = line.split(":")[-1].lstrip("*").strip()
+            elif "**Name as on Document:**" in line:
+                extracted_data["nameAsOnDoc"] = line.split(":")[-1].lstrip("*").strip()
+            elif "**Gender:**" in line:
+                extracted_data["Gender"] = line.split(":")[-1].lstrip("*").strip()
+            elif "**Address:**" in line:
+                extracted_data["Address"] = line.split(":")[-1].lstrip("*").strip()
+
+    for key in REQUIRED_KEYS:
+        if key not in extracted_data or not extracted_data[key]:
+            extracted_data[key] = "NA"
+
+    return extracted_data
+
+def merge_id_card_responses(responses, document_type):
+    """Merge samples field by field, preferring the first value that passes validation."""
+    validators = ID_CARD_FIELD_VALIDATORS.get(document_type, {})
+    merged_response = {}
+    for key in REQUIRED_KEYS:
+        values = [resp[key] for resp in responses if key in resp and resp[key] not in MISSING_VALUES]
+        if key in validators:
+            values = [value for value in values if validators[key](value)] or values
+        merged_response[key] = values[0] if values else "NA"
+    return merged_response
+
+def invalid_id_card_fields(extracted_data, document_type):
+    validators = ID_CARD_FIELD_VALIDATORS.get(document_type, {})
+    return [key for key, validator in validators.items() if not validator(extracted_data[key])]
+
+
+def extract_pages(images_base64, prompt, on_page_done=None, on_token=None, page_texts=None, document_type=None):
+    """Run one /api/generate call per page concurrently; responses come back in page order.
+
+    images_base64 may be a generator such as process_file: each page is submitted
+    as soon as it is yielded, and rendering stays at most a few pages ahead of
+    the calls in flight.
+
+    on_page_done(page_index, response), if given, is called from the worker thread
+    as each page finishes. on_token(page_number, token), if given, switches the
+    calls to Ollama streaming and receives every generated token. Pages with an
+    entry in page_texts are sent as text instead of as an image. document_type
+    selects the output schema and generation options of the calls.
+    """
+    def extract_page(i, img_base64):
+        page_text = page_texts[i] if page_texts else None
+        if page_text:
+            extraction_payload = {
+                "model": TEXT_MODEL_NAME,
+                "prompt": f"{prompt}\n\nThe page is given as the text of its PDF text layer instead of an image:\n\n{page_text}",
+                "options": generation_options(document_type),
+                "stream": False
+            }
+        else:
+            extraction_payload = {
+                "model": MODEL_NAME,
+                "prompt": prompt,
+                "images": [img_base64],  #  Send only ONE image at a time
+                "options": generation_options(document_type),
+                "stream": False
+            }
+        with_output_schema(extraction_payload, OUTPUT_SCHEMAS.get(document_type))
+        cache_key = page_cache_key(page_text or img_base64, extraction_payload)
+        cached = page_cache.get(cache_key)
+        if cached is not None:
+            response = RebuiltResponse(200, cached)
+            if on_token:
+                on_token(i + 1, cached.get("response", ""))
+        else:
+            if on_token:
+                response = make_streaming_api_request(extraction_payload, lambda token: on_token(i + 1, token))
+            else:
+                response = make_api_request(extraction_payload)
+            if response.status_code == 200:
+                # Only what is read back; Ollama's reply also carries the token ids of its context
+                answer = response.json()
+                page_cache.put(cache_key, {"response": answer.get("response", ""), "done_reason": answer.get("done_reason")})
+        if is_truncated(response):
+            record_truncation(document_type or "Extraction")
+            print(f"Page {i + 1} answer truncated at num_predict={extraction_payload['options'].get('num_predict')}")
+        if on_page_done:
+            on_page_done(i, response)
+        return response
+
+    in_flight = threading.BoundedSemaphore(2 * MAX_CONCURRENT_PAGE_REQUESTS)
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PAGE_REQUESTS) as executor:
+        futures = []
+        try:
+            for i, img_base64 in enumerate(images_base64):
+                in_flight.acquire()  # Don't hold rendered pages the workers can't start on yet
+                future = executor.submit(extract_page, i, img_base64)
+                future.add_done_callback(lambda future: in_flight.release())
+                futures.append(future)
+            return [future.result() for future in futures]
+        except Exception:
+            executor.shutdown(cancel_futures=True)  # Don't start pages nobody will read
+            raise
+
+
+def crop_candidate_photo(image_base64):
+    """Crop the candidate photo from the first page and return it as a JPEG data URI."""
+    image = Image.open(io.BytesIO(base64.b64decode(image_base64)))
     width, height = image.size
     
     left = int(width * 0.75)
@@ -73,19 +1183,33 @@ def crop_candidate_photo(image_path):
     right = int(width * 0.95)
     bottom = int(height * 0.35)
     
-    cropped_image = image.crop((left, top, right, bottom))
-    photo_path = os.path.join(UPLOAD_FOLDER, "candidate_photo.png")
-    cropped_image.save(photo_path, "PNG")
-    return photo_path
+    cropped_image = downscale_image(image.crop((left, top, right, bottom)), CANDIDATE_PHOTO_MAX_EDGE)
+    return "data:image/jpeg;base64," + encode_pil_image(cropped_image, "JPEG", 85)
 
 
 def determine_document_type(images_base64):
     if not images_base64:
         return None  # Ensure we have at least one image
 
+    if not CLASSIFICATION_INDEX_PATH:
+        return classify_with_model(images_base64)
+
+    # Our traffic is dominated by a few layouts; reuse the type of a near-identical first page
+    image_hash = perceptual_hash(images_base64[0])
+    document_type = classification_index.lookup(image_hash)
+    if document_type:
+        print(f"Classification index hit: {document_type}")
+        return document_type
+
+    document_type = classify_with_model(images_base64)
+    if document_type != "Unknown Document":
+        classification_index.add(image_hash, document_type)
+    return document_type
+
+def classify_with_model(images_base64):
     # Process only the first page for document type classification
     payload = {
-        "model": "llama3.2-vision",
+        "model": MODEL_NAME,
         "prompt": """Analyze the provided image and classify it as one of the following:
             - 'Aadhaar Card' (if Aadhaar-related words like "Aadhaar", "Unique Identification", "UIDAI" are present.
             this word can be small letters also).
@@ -96,128 +1220,322 @@ def determine_document_type(images_base64):
             it can be all letters small case also.
             - 'Pay Slip' (if words like 'Pay Slip', 'Salary Statement', 'Net Pay Amount' appears on that document).
             - 'result' (if words like 'Marks', 'grade', 'Hall Ticket Number', 'Roll No', 'University' appears on that document)
-            Always return only one of these five options.
-
+            Answer with only the label: 'Aadhaar Card', 'PAN Card', 'Credence', 'Pay Slip' or 'result'.
+            Do not explain or add any other text.
             """,
         "images": [images_base64[0]],  # Only checking the first page
-        "temperature": 0.0,
+        "options": generation_options("Classification"),
         "stream": False
     }
+    payload = with_output_schema(payload, {
+        "type": "object",
+        "properties": {"documentType": {"type": "string", "enum": list(CLASSIFICATION_LABELS)}},
+        "required": ["documentType"],
+    })
 
     response = make_api_request(payload)
 
     if response.status_code == 200:
+        if is_truncated(response):
+            record_truncation("Classification")
+            print(f"Classification answer truncated at num_predict={payload['options'].get('num_predict')}")
         try:
             document_type_response = response.json().get("response", "").strip()
             print(document_type_response)
-            if "Credence" in document_type_response:
-                return "Credence Document"
-            elif "Aadhaar" in document_type_response:
-                return "Aadhaar Card"
-            elif "PAN" in document_type_response:
-                return "PAN Card"
-            elif "pay slip" in document_type_response or "payslip" in document_type_response or "salary statement" in document_type_response:
-                return "Pay Slip"
-            elif "marks" in document_type_response or "grades" in document_type_response or "roll number" in document_type_response or "student's name" in document_type_response or "details of their academic performance" in document_type_response or "University" in document_type_response:
-                return "Result"
-            else:
-                return "Unknown Document"  # Instead of None, return an explicit unknown type
-            
+            structured = parse_structured_answer(document_type_response)
+            if isinstance(structured, dict) and structured.get("documentType") in CLASSIFICATION_LABELS:
+                return CLASSIFICATION_LABELS[structured["documentType"]]
+            return document_type_from_answer(document_type_response)
         except json.JSONDecodeError:
             print("Error parsing API JSON response")
 
     return "Unknown Document"
 
+def document_type_from_answer(document_type_response):
+    """Map the model's free-text classification answer to a document type, ignoring case."""
+    answer = document_type_response.lower()
+    if "credence" in answer:
+        return "Credence Document"
+    elif "aadhaar" in answer:
+        return "Aadhaar Card"
+    elif re.search(r"\bpan\b", answer):  # Not "company" or "panel"
+        return "PAN Card"
+    elif "pay slip" in answer or "payslip" in answer or "salary statement" in answer:
+        return "Pay Slip"
+    elif "result" in answer or "marks" in answer or "grades" in answer or "roll number" in answer or "student's name" in answer or "details of their academic performance" in answer or "university" in answer:
+        return "Result"
+    else:
+        return "Unknown Document"  # Instead of None, return an explicit unknown type
+
+def classify_and_extract(image_base64):
+    """Classify a first page and, for an Aadhaar/PAN card, extract its fields in the same call.
+
+    Returns (document_type, extracted_data). extracted_data is the parsed
+    REQUIRED_KEYS sample for ID cards and None otherwise, including when the
+    type came from the classification index without a model call.
+    """
+    image_hash = perceptual_hash(image_base64) if CLASSIFICATION_INDEX_PATH else None
+    document_type = classification_index.lookup(image_hash) if image_hash else None
+    if document_type:
+        print(f"Classification index hit: {document_type}")
+        return document_type, None
+
+    combined_schema = {
+        "type": "object",
+        "properties": {"category": {"type": "string", "enum": list(CLASSIFICATION_LABELS)}, **ID_CARD_SCHEMA["properties"]},
+        "required": ["category"],
+    }
+    payload = with_output_schema({
+        "model": MODEL_NAME,
+        "prompt": build_classify_and_extract_prompt(),
+        "images": [image_base64],
+        "options": generation_options("Aadhaar Card"),
+        "stream": False
+    }, combined_schema)
+    response = make_api_request(payload)
+    if response.status_code != 200:
+        return "Unknown Document", None
+
+    try:
+        answer = response.json().get("response", "").strip()
+    except json.JSONDecodeError:
+        print("Error parsing API JSON response")
+        return "Unknown Document", None
+    print(answer)
+
+    structured = parse_structured_answer(answer)
+    if isinstance(structured, dict):
+        document_type = CLASSIFICATION_LABELS.get(structured.get("category"), "Unknown Document")
+    else:
+        category = next((line for line in answer.split("\n") if "**Category:**" in line), answer)
+        document_type = document_type_from_answer(category)
+    if image_hash and document_type != "Unknown Document":
+        classification_index.add(image_hash, document_type)
+    if document_type in ["Aadhaar Card", "PAN Card"]:
+        return document_type, parse_id_card_response(answer)
+    return document_type, None
+
+speculation_executor = ThreadPoolExecutor(max_workers=SPECULATION_WORKERS)
+speculation_stats = {"started": 0, "used": 0, "discarded": 0}
+speculation_lock = threading.Lock()
+
+def start_id_card_speculation(file_bytes, file_ext):
+    """Send the ID-card extraction call for a single-image upload; returns its future, or None."""
+    if not SPECULATIVE_ID_CARD_EXTRACTION or file_ext == "pdf":
+        return None
+    id_card_image = next(process_file(file_bytes, file_ext, "Aadhaar Card"), None)
+    if not id_card_image:
+        return None
+    with speculation_lock:
+        speculation_stats["started"] += 1
+    return speculation_executor.submit(make_api_request, id_card_extraction_payload([id_card_image]))
+
+def settle_id_card_speculation(speculation, document_type):
+    """Keep the speculative call if the upload is an ID card; otherwise count it as discarded."""
+    if speculation is None:
+        return None
+    used = document_type in ["Aadhaar Card", "PAN Card"]
+    with speculation_lock:
+        speculation_stats["used" if used else "discarded"] += 1
+    if used:
+        return speculation
+    speculation.cancel()  # Only helps while it is still queued; a running call is left to finish
+    return None
+
+@app.errorhandler(ModelBackendUnavailable)
+def model_backend_unavailable(e):
+    return jsonify({"status": "error", "error": str(e)}), 503
+
+def fail_fast_if_backend_down(file_bytes):
+    """Raise ModelBackendUnavailable while the circuit is open, unless the upload's result is cached.
+
+    Saves rasterizing a document we cannot extract; a cached result needs no model call.
+    """
+    if api_circuit_breaker.is_open() and result_cache.get(result_cache_key(file_bytes)) is None:
+        raise ModelBackendUnavailable("Model API is unavailable (circuit breaker open)")
+
 @app.route("/ocr", methods=["POST"])
 def ocr_extraction():
     if "file" not in request.files:
         return jsonify({"error": "No file provided"}), 400
 
-    file = request.files["file"]
-    images_base64 = process_file(file)
-    document_type = determine_document_type(images_base64)
+    file_bytes, file_ext = read_upload(request.files["file"])
+    fail_fast_if_backend_down(file_bytes)
+    body, status_code = run_ocr_pipeline(file_bytes, file_ext)
+    return jsonify(body), status_code
+
+
+def run_ocr_pipeline(file_bytes, file_ext, on_progress=None, on_page=None, on_token=None):
+    """Return the cached result for an identical upload, or run extract_document and cache it.
+
+    Only successful results with every page extracted are cached. Takes the same
+    arguments as extract_document.
+    """
+    cache_key = result_cache_key(file_bytes)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        print(f"Result cache hit {cache_key[:12]}")
+        body = cached["body"]
+        if on_progress:
+            on_progress({"stage": "cached", "documentType": cached["documentType"]})
+        if on_page:
+            for record in body.get("extractedData", []) if isinstance(body, dict) else []:
+                on_page(record)
+        return body, 200
+
+    document_type = None
+    pages_total = None
+
+    def track_progress(update):
+        nonlocal document_type, pages_total
+        document_type = update.get("documentType", document_type)
+        pages_total = update.get("pagesTotal", pages_total)
+        if on_progress:
+            on_progress(update)
+
+    body, status_code = extract_document(file_bytes, file_ext, track_progress, on_page, on_token)
+    # A page that failed even after retries is left out of extractedData; don't
+    # keep serving that partial result for every re-upload
+    complete = "extractedData" not in body or len(body["extractedData"]) == pages_total
+    if status_code == 200 and complete:
+        result_cache.put(cache_key, {"documentType": document_type, "body": body})
+    elif status_code == 200:
+        print(f"Not caching partial result: {len(body['extractedData'])} of {pages_total} pages extracted")
+    return body, status_code
+
+
+def extract_document(file_bytes, file_ext, on_progress=None, on_page=None, on_token=None):
+    """Classify and extract an upload; returns (response body, HTTP status code).
+
+    Needs no Flask request context, so /ocr, /ocr/stream and the /jobs workers share it.
+    on_progress, if given, is called with a dict of updated progress fields.
+    on_page, if given, receives {"page": n, "data": answer} for each page of a
+    multi-page document as soon as that page is extracted, with the answer parsed
+    when STRUCTURED_OUTPUT is on; on_token is passed on to extract_pages.
+    """
+    report = on_progress or (lambda update: None)
+    request_id = uuid.uuid4().hex
+
+    report({"stage": "classifying"})
+    page_texts = read_text_layer(file_bytes) if file_ext == "pdf" and TEXT_LAYER_ENABLED else []
+    document_type = classify_text(page_texts[0]) if page_texts and page_texts[0] else None
+    id_card_sample = None
+    id_card_speculation = None
+    if document_type:
+        print(f"Classified from the PDF text layer: {document_type}")
+    elif ID_CARD_COMBINED_MODE:
+        first_page = next(process_file(file_bytes, file_ext, "Aadhaar Card", page_numbers=[1]), None)
+        document_type, id_card_sample = classify_and_extract(first_page) if first_page else (None, None)
+    else:
+        speculation = start_id_card_speculation(file_bytes, file_ext)
+        # Classify a small rendition of the first page only, without waiting for the whole PDF
+        first_page = next(process_file(file_bytes, file_ext, "Classification", page_numbers=[1]), None)
+        document_type = determine_document_type([first_page] if first_page else [])
+        id_card_speculation = settle_id_card_speculation(speculation, document_type)
     print(document_type)
     
     if not document_type:
-        return jsonify({"error": "Could not determine document type"}), 400
+        return {"error": "Could not determine document type"}, 400
+
+    if any(page_texts) and document_type not in ["Aadhaar Card", "PAN Card"]:
+        # Only rasterize pages without a usable text layer, plus the Credence cover
+        # page the candidate photo is cropped from
+        image_pages = [n for n, text in enumerate(page_texts, 1)
+                       if not text or (n == 1 and document_type == "Credence Document")]
+        rendered = process_file(file_bytes, file_ext, document_type, image_pages)
+        images_base64 = (next(rendered, None) if n in image_pages else None for n in range(1, len(page_texts) + 1))
+        pages_total = len(page_texts)
+        print(f"Text layer used for {len(page_texts) - len(image_pages)} of {len(page_texts)} pages")
+    else:
+        page_texts = []
+        # Pages are rendered lazily, while the first ones are already being extracted
+        images_base64 = process_file(file_bytes, file_ext, document_type)
+        pages_total = count_pages(file_bytes, file_ext)
+    report({"stage": "extracting", "documentType": document_type, "pagesTotal": pages_total, "pagesDone": 0})
+
+    pages_done = 0
+    pages_lock = threading.Lock()
+
+    def page_done(i, response):
+        nonlocal pages_done
+        with pages_lock:
+            pages_done += 1
+            report({"pagesDone": pages_done})
+        if on_page and response.status_code == 200:
+            on_page({"page": i + 1, "data": parse_structured_answer(response.json().get("response", "")),
+                     "truncated": is_truncated(response)})
 
     if document_type in ["Aadhaar Card", "PAN Card"]:
-        # Define the extraction prompt
-        prompt_text = (
-                "Act as an OCR assistant. Analyze the provided (PDF or image) and return the extracted fields in JSON format."
-                "Extract the following details if present in the (PDF or image):"
-                "Document Type(if it is aadhaar card then show Aadhaar card if it is pan card then show PAN card)"
-                "Document Number(aadhard card or pan card number)"
-                "Date of Birth/Issue(show in date formats it could be DOB)"
-                "Name as on Document(first line of name)"
-                "Father's/Guardian's Name(Father's Name line directly below the Name)"
-                "Gender, and Address(show only address if it is here not any sentences and if not address"
-                "then show only N/A)"
-                "If any field is missing, return 'NA' for that field."
-                "from extracted details I want only specific information"
-        )
-        
-        extraction_payload = {
-            "model": "llama3.2-vision",
-            "prompt": prompt_text,
-            "images": images_base64,
-            "temperature": 0.0,
-            "stream": False
-        }
+        images_base64 = list(images_base64)  # Every sample sends the whole card
+        extraction_payload = id_card_extraction_payload(images_base64, document_type)
 
         valid_responses = []
-        for _ in range(3):
-            response = make_api_request(extraction_payload)
-            print(response)
-            if response.status_code == 200:
-                try:
-                    json_response = response.json()
-                    extracted_text = json_response.get("response", "")
-                    extracted_data = {}
-
-                    for line in extracted_text.split("\n"):
-                        if "**Document Type:**" in line:
-                            extracted_data["documentType"] = line.split(":")[-1].lstrip("*").strip()
-                        elif "**Document Number:**" in line:
-                            extracted_data["documentNumber"] = line.split(":")[-1].lstrip("*").strip()
-                        elif "**Date of Birth/Issue:**" in line:
-                            extracted_data["dateOfBirthorIssue"] = line.split(":")[-1].lstrip("*").strip()
-                        elif "**Father's/Guardian's Name:**" in line:
-                            extracted_data["FatherGuardianName"] = line.split(":")[-1].lstrip("*").strip()
-                        elif "**Name as on Document:**" in line:
-                            extracted_data["nameAsOnDoc"] = line.split(":")[-1].lstrip("*").strip()
-                        elif "**Gender:**" in line:
-                            extracted_data["Gender"] = line.split(":")[-1].lstrip("*").strip()
-                        elif "**Address:**" in line:
-                            extracted_data["Address"] = line.split(":")[-1].lstrip("*").strip()
-
-                    for key in REQUIRED_KEYS:
-                        if key not in extracted_data or not extracted_data[key]:
-                            extracted_data[key] = "NA"
-
-                    if any(extracted_data[key] != "NA" for key in REQUIRED_KEYS):
-                        valid_responses.append(extracted_data)
-                except json.JSONDecodeError:
-                    return jsonify({"error": "Error parsing JSON response"}), 500
+        samples_drawn = 0
+        failed_fields = None
+        truncated = False
+        if id_card_sample is not None:
+            # The combined classify-and-extract call already drew the first sample
+            samples_drawn = 1
+            if any(id_card_sample[key] != "NA" for key in REQUIRED_KEYS):
+                valid_responses.append(id_card_sample)
+            merged_response = merge_id_card_responses(valid_responses, document_type)
+            failed_fields = invalid_id_card_fields(merged_response, document_type)
+            print(f"ID card sample {samples_drawn}: fields failing validation {failed_fields}")
+
+        while samples_drawn < ID_CARD_SAMPLES and failed_fields != []:
+            if samples_drawn == 0 and id_card_speculation is not None:
+                responses = [id_card_speculation.result()]  # Sent alongside the classification call
             else:
-                return jsonify({"error": f"API request failed with status code {response.status_code}", "message": response.text}), 500
+                if samples_drawn == 0:
+                    payloads = [extraction_payload]  # A clean scan is usually settled by one call
+                else:
+                    # Ask the remaining samples only for the fields that failed validation
+                    retry_payload = with_output_schema({**extraction_payload, "prompt": build_id_card_prompt(failed_fields)},
+                                                       id_card_schema(failed_fields))
+                    payloads = [
+                        {**retry_payload, "options": {**retry_payload["options"],
+                                                      "temperature": ID_CARD_SAMPLE_TEMPERATURE, "seed": seed}}
+                        for seed in range(samples_drawn, ID_CARD_SAMPLES)
+                    ]
+                with ThreadPoolExecutor(max_workers=len(payloads)) as executor:
+                    responses = list(executor.map(make_api_request, payloads))
+            samples_drawn += len(responses)
+
+            for response in responses:
+                print(response)
+                if is_truncated(response):
+                    record_truncation(document_type)
+                    truncated = True
+                if response.status_code == 200:
+                    try:
+                        extracted_data = parse_id_card_response(response.json().get("response", ""))
+                        if any(extracted_data[key] != "NA" for key in REQUIRED_KEYS):
+                            valid_responses.append(extracted_data)
+                    except json.JSONDecodeError:
+                        return {"error": "Error parsing JSON response"}, 500
+                else:
+                    return {"error": f"API request failed with status code {response.status_code}", "message": response.text}, 500
 
-        merged_response = {}
-        for key in REQUIRED_KEYS:
-            values = [resp[key] for resp in valid_responses if key in resp and resp[key] not in ["Not available", "N/A", "Not Visible"]]
-            merged_response[key] = values[0] if values else "NA"
+            merged_response = merge_id_card_responses(valid_responses, document_type)
+            failed_fields = invalid_id_card_fields(merged_response, document_type)
+            print(f"ID card sample {samples_drawn}: fields failing validation {failed_fields}")
 
-        return jsonify(merged_response), 200
+        report({"pagesDone": pages_total})
+        return {**merged_response, "truncated": truncated}, 200
     elif document_type == 'Credence Document':
-        first_page_path = save_image(images_base64[0], "first_page.png")
-        candidate_photo_path = crop_candidate_photo(first_page_path)
-        extracted_data = []
-        for i, img_base64 in enumerate(images_base64):
-            img_base64 = encode_image(save_image(img_base64, f"page_{i}.png"))
-
-            extraction_payload = {
-                "model": "llama3.2-vision",
-                "prompt": ( """Extract all the details from the image without describing the image.
+        candidate_photo = None
+
+        def credence_pages():
+            # Crop the photo and archive each page as it is rendered
+            nonlocal candidate_photo
+            for i, img_base64 in enumerate(images_base64):
+                if i == 0:
+                    candidate_photo = crop_candidate_photo(img_base64)
+                if ARCHIVE_PAGES and img_base64:
+                    archive_page(img_base64, i + 1, document_type, request_id)
+                yield img_base64
+
+        credence_prompt = """Extract all the details from the image without describing the image.
                     Ensure the extracted data is in structured JSON format, including all fields without missing any information.
                     Do not include descriptions of sections, images, colors, or text formatting.
                     Do not include phrases like "Here is the extracted data in structured JSON format:" in the response.
@@ -243,21 +1561,16 @@ def ocr_extraction():
                     -   "*   Section 3":"Consent Form"
                     -   "*   Section 4":"Signature"
                     -   "*   Section 5":"Witness Details" """
-                    ),
-                "images": [img_base64],
-                "temperature": 0.0,
-                "stream": False
-            }
-            response = make_api_request(extraction_payload)
-            
+
+        extracted_data = []
+        for i, response in enumerate(extract_pages(credence_pages(), credence_prompt, page_done, on_token, page_texts,
+                                                   document_type)):
             if response.status_code == 200:
                 json_response = response.json()
-                extracted_page_data = json_response.get("response", "")
-                extracted_data.append({"page": i + 1, "data": extracted_page_data})
-            
-            time.sleep(1)  # Avoid API rate limits
+                extracted_page_data = parse_structured_answer(json_response.get("response", ""))
+                extracted_data.append({"page": i + 1, "data": extracted_page_data, "truncated": is_truncated(response)})
         
-        return jsonify({"documentType": "Credence Document", "extractedData": extracted_data, "candidatePhotoPath": candidate_photo_path}), 200
+        return {"documentType": "Credence Document", "extractedData": extracted_data, "candidatePhoto": candidate_photo}, 200
 
     elif document_type == "Pay Slip":
         payslip_prompt = """Extract structured data from the provided payslip(s).
@@ -291,61 +1604,43 @@ def ocr_extraction():
             Avoid including headers, footers, or repeated details.
         """
 
+        # One call per page, run concurrently; ModelBackendUnavailable becomes a 503
+        responses = extract_pages(images_base64, payslip_prompt, page_done, on_token, page_texts, document_type)
+
         extracted_data = []  # Store extracted data for each page
 
-        for i, img_base64 in enumerate(images_base64):  #  Process each image separately
-            extraction_payload = {
-                "model": "llama3.2-vision",
-                "prompt": payslip_prompt,
-                "images": [img_base64],  #  Send only ONE image at a time
-                "temperature": 0.0,
-                "stream": False
-            }
+        for i, response in enumerate(responses):
+            print(f"Payslip API Raw Response (Page {i+1}): {response.text}")  # Debugging
 
-            try:
-                response = make_api_request(extraction_payload)
-                print(f"Payslip API Raw Response (Page {i+1}): {response.text}")  # Debugging
-
-                if response.status_code == 200:
-                    try:
-                        json_response = response.json()
-                        page_data = json_response.get("response", "").strip()
+            if response.status_code == 200:
+                try:
+                    json_response = response.json()
+                    page_data = parse_structured_answer(json_response.get("response", "").strip())
 
-                        if page_data:
-                            extracted_data.append({"page": i + 1, "data": page_data})  #  Store each page separately
+                    if page_data:
+                        extracted_data.append({"page": i + 1, "data": page_data, "truncated": is_truncated(response)})  #  Store each page separately
 
-                    except json.JSONDecodeError:
-                        return jsonify({
-                            "status": "error",
-                            "message": "Error decoding API JSON response"
-                        }), 500
-
-                else:
-                    return jsonify({
+                except json.JSONDecodeError:
+                    return {
                         "status": "error",
-                        "message": f"API request failed with status code {response.status_code}"
-                    }), 500
+                        "message": "Error decoding API JSON response"
+                    }, 500
 
-            except requests.exceptions.RequestException as e:
-                return jsonify({
+            else:
+                return {
                     "status": "error",
-                    "message": f"API request failed: {str(e)}"
-                }), 500
+                    "message": f"API request failed with status code {response.status_code}"
+                }, 500
 
-        return jsonify({
+        return {
             "status": "success",
             "message": "OCR Extraction Completed",
             "documentType": "Pay Slip",
             "extractedData": extracted_data  #  Now returns data from all pages
-        }), 200
+        }, 200
 
     elif document_type == "Result":
-        extracted_data = []
-
-        for i, img_base64 in enumerate(images_base64):
-            extraction_payload = {
-                "model": "llama3.2-vision",
-                "prompt": """Extract all available details from the result, including student name,
+        result_prompt = """Extract all available details from the result, including student name,
                 roll number, hall ticket number, year of admission, college name, final exam month and year,
                 and class awarded. Additionally, extract all semisters data with all subjects along with their corresponding marks obtained
                 as it is shown in document.
@@ -353,52 +1648,230 @@ def ocr_extraction():
                 Ensure the marks is same as it shown in documents, don't change the values.
                 ensure the aggregate marks also shown in json response.
                 Do not add assumptions or unnecessary descriptions.
-                Ensure the extracted data is formatted as a structured JSON object with clear key-value pairs.""",
-                "images": [img_base64],  #  Send only ONE image at a time
-                "temperature": 0.0,
-                "stream": False
-            }
+                Ensure the extracted data is formatted as a structured JSON object with clear key-value pairs."""
 
-            response = make_api_request(extraction_payload)
+        extracted_data = []
+
+        for i, response in enumerate(extract_pages(images_base64, result_prompt, page_done, on_token, page_texts,
+                                                   document_type)):
             print(f"API Response (Page {i+1}): {response.text}")  # Debugging
 
             if response.status_code == 200:
                 try:
                     json_response = response.json()
-                    extracted_page_data = json_response.get("response", "")
+                    extracted_page_data = parse_structured_answer(json_response.get("response", ""))
 
                     if extracted_page_data:
-                        extracted_data.append({"page": i + 1, "data": extracted_page_data})  #  Store each page separately
+                        extracted_data.append({"page": i + 1, "data": extracted_page_data, "truncated": is_truncated(response)})  #  Store each page separately
 
                 except json.JSONDecodeError:
-                    return jsonify({
+                    return {
                         "status": "error",
                         "message": "Error decoding API JSON response"
-                    }), 500
+                    }, 500
 
             else:
-                return jsonify({
+                return {
                     "status": "error",
                     "message": f"API request failed with status code {response.status_code}"
-                }), 500
-
-            time.sleep(1)  # Avoid API rate limits
+                }, 500
 
-        return jsonify({
+        return {
             "status": "success",
             "message": "OCR Extraction Completed",
             "documentType": "Result",
             "extractedData": extracted_data  #  Now returns data from all pages
-        }), 200
+        }, 200
 
 
 
     else:
-        return jsonify({"status": "error", "message": "Invalid document type"}), 400
+        return {"status": "error", "message": "Invalid document type"}, 400
         
+@app.route("/ocr/stream", methods=["POST"])
+def ocr_stream():
+    """/ocr as a stream of events, sent as soon as they happen.
+
+    Each line is a JSON object with an "event" of "progress", "page" (with
+    "page" and "data", for multi-page documents), "token" (with ?tokens=1, the
+    model's output as it is generated) and finally "result", carrying the body
+    and status code /ocr would have returned. Sent as NDJSON, or as
+    server-sent events when the client accepts text/event-stream.
+    """
+    if "file" not in request.files:
+        return jsonify({"error": "No file provided"}), 400
+
+    file_bytes, file_ext = read_upload(request.files["file"])
+    fail_fast_if_backend_down(file_bytes)
+    stream_tokens = request.args.get("tokens", "").lower() in ["1", "true", "yes"]
+    use_sse = "text/event-stream" in request.headers.get("Accept", "")
+    events = queue.Queue()
+
+    def run():
+        try:
+            body, status_code = run_ocr_pipeline(
+                file_bytes, file_ext,
+                on_progress=lambda update: events.put({"event": "progress", **update}),
+                on_page=lambda record: events.put({"event": "page", **record}),
+                on_token=(lambda page, token: events.put({"event": "token", "page": page, "token": token}))
+                if stream_tokens else None
+            )
+        except ModelBackendUnavailable as e:
+            body, status_code = {"status": "error", "error": str(e)}, 503
+        except Exception as e:
+            print(f"Streaming OCR failed: {e}")
+            body, status_code = {"status": "error", "error": str(e)}, 500
+        events.put({"event": "result", "statusCode": status_code, "data": body})
+        events.put(None)  # End of stream
+
+    threading.Thread(target=run, daemon=True).start()
+
+    def generate():
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            line = json.dumps(event)
+            yield f"data: {line}\n\n" if use_sse else line + "\n"
+
+    mimetype = "text/event-stream" if use_sse else "application/x-ndjson"
+    return Response(generate(), mimetype=mimetype, headers={"Cache-Control": "no-cache"})
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify({
+        "results": result_cache.stats(),
+        "pages": page_cache.stats(),
+        "classification": classification_index.stats()
+    }), 200
+
+@app.route("/model/status", methods=["GET"])
+def model_status():
+    """Whether each configured model is currently loaded on the model server, from Ollama's /api/ps."""
+    ps_url = API_URL.rsplit("/api/", 1)[0] + "/api/ps"
+    try:
+        response = api_session.get(ps_url, timeout=(API_CONNECT_TIMEOUT, 10))
+        response.raise_for_status()
+        loaded_models = response.json().get("models", [])
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return jsonify({"status": "error", "error": f"Could not query the model server: {e}"}), 503
+
+    models = {}
+    for model_name in configured_models():
+        # Ollama reports untagged names with their implicit :latest tag
+        loaded = next((model for model in loaded_models
+                       if model.get("name") in [model_name, f"{model_name}:latest"]), None)
+        models[model_name] = {
+            "resident": loaded is not None,
+            "expiresAt": loaded.get("expires_at") if loaded else None,
+            "sizeVram": loaded.get("size_vram") if loaded else None,
+        }
+    return jsonify({
+        "models": models,
+        "keepAlive": MODEL_KEEP_ALIVE,
+        "idleSeconds": round(time.monotonic() - last_model_activity),
+        "truncatedAnswers": dict(truncation_stats)
+    }), 200
+
+@app.route("/speculation/stats", methods=["GET"])
+def speculation_stats_route():
+    with speculation_lock:
+        stats = dict(speculation_stats)
+    settled = stats["used"] + stats["discarded"]
+    stats["payoffRate"] = round(stats["used"] / settled, 3) if settled else None
+    return jsonify(stats), 200
+
+
+# Background OCR jobs: POST /jobs returns a job id at once and the pipeline runs
+# on JOB_WORKERS threads. Finished jobs are kept for JOB_RESULT_TTL seconds.
+# Jobs live in this process's memory, so serve /jobs from a single process
+# (with threads) or route a client's polls to the worker that accepted the job.
+JOB_WORKERS = 2
+JOB_RESULT_TTL = 3600
+
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+jobs = {}
+jobs_lock = threading.Lock()
+
+
+def update_job(job_id, update):
+    with jobs_lock:
+        jobs[job_id].update(update)
+
+def purge_expired_jobs():
+    now = time.time()
+    with jobs_lock:
+        for job_id in [job_id for job_id, job in jobs.items()
+                       if job["finishedAt"] and now - job["finishedAt"] > JOB_RESULT_TTL]:
+            del jobs[job_id]
+
+def run_job(job_id, file_bytes, file_ext):
+    update_job(job_id, {"status": "running"})
+    try:
+        body, status_code = run_ocr_pipeline(file_bytes, file_ext, lambda update: update_job(job_id, update))
+    except ModelBackendUnavailable as e:
+        body, status_code = {"status": "error", "error": str(e)}, 503
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")
+        body, status_code = {"status": "error", "error": str(e)}, 500
+    update_job(job_id, {
+        "status": "completed" if status_code == 200 else "failed",
+        "stage": "done",
+        "statusCode": status_code,
+        "result": body,
+        "finishedAt": time.time()
+    })
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    if "file" not in request.files:
+        return jsonify({"error": "No file provided"}), 400
+
+    purge_expired_jobs()
+    file_bytes, file_ext = read_upload(request.files["file"])
+    fail_fast_if_backend_down(file_bytes)
+    job_id = uuid.uuid4().hex
+    with jobs_lock:
+        jobs[job_id] = {
+            "jobId": job_id,
+            "status": "queued",
+            "stage": None,
+            "documentType": None,
+            "pagesTotal": None,
+            "pagesDone": 0,
+            "statusCode": None,
+            "result": None,
+            "submittedAt": time.time(),
+            "finishedAt": None
+        }
+    job_executor.submit(run_job, job_id, file_bytes, file_ext)
+
+    status_url = url_for("get_job", job_id=job_id)
+    return jsonify({"jobId": job_id, "status": "queued", "statusUrl": status_url}), 202, {"Location": status_url}
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    purge_expired_jobs()
+    with jobs_lock:
+        job = jobs.get(job_id)
+        job = dict(job) if job else None
+    if not job:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job), 200
+
+
+# Run as a script, the backend serves with werkzeug's reloader, which loads this
+# module once more in a watcher process that never serves requests
+USE_RELOADER = True
+
 if __name__ == "__main__":
+    # With the reloader, only the child process it spawns serves requests
+    if not USE_RELOADER or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_model_warmer()
     # app.run(host="172.16.11.39", port=5002, debug=True)
-    app.run(debug=True)
+    # Nothing on the request path uses shared file names, so requests can be served concurrently
+    app.run(debug=True, threaded=True, use_reloader=USE_RELOADER)
 
 
 
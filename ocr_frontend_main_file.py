@@ -1,9 +1,58 @@
 import streamlit as st
 import requests
 import json
+import time
+import base64
 
-# API Endpoint
+# API Endpoints
 BACKEND_URL = "http://127.0.0.1:5000/ocr"
+JOBS_URL = "http://127.0.0.1:5000/jobs"
+OCR_TIMEOUT = 150  # Seconds to wait for a synchronous /ocr answer
+
+# Submit PDFs as background jobs polled with a progress bar instead of one blocking
+# /ocr call. Job state lives in the memory of the backend process that accepted the
+# job, so only enable this against a single backend process or with sticky routing.
+# Images always use /ocr, which answers a single ID card without polling delays.
+USE_JOBS_FOR_PDFS = False
+JOB_FIRST_POLL_INTERVAL = 0.25  # Seconds before the first status check, doubled after each one
+JOB_POLL_INTERVAL = 2  # Longest wait between status checks
+JOB_TIMEOUT = 1800  # Stop waiting for a job after this many seconds
+
+
+def run_ocr_request(files):
+    """Run the upload through /ocr in one blocking call; returns it shaped like a finished job."""
+    response = requests.post(BACKEND_URL, files=files, timeout=OCR_TIMEOUT)
+    response.raise_for_status()  # Raise error for HTTP failure
+    return {"status": "completed", "statusCode": response.status_code, "result": response.json()}
+
+
+def run_ocr_job(files, progress_bar):
+    """Submit the upload as an OCR job and poll it until it completes or fails."""
+    submit_response = requests.post(JOBS_URL, files=files, timeout=30)
+    submit_response.raise_for_status()
+    status_url = f"{JOBS_URL}/{submit_response.json()['jobId']}"
+
+    deadline = time.time() + JOB_TIMEOUT
+    poll_interval = JOB_FIRST_POLL_INTERVAL
+    while time.time() < deadline:
+        time.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, JOB_POLL_INTERVAL)
+
+        status_response = requests.get(status_url, timeout=10)
+        if status_response.status_code == 404:
+            raise requests.exceptions.HTTPError(
+                "OCR job not found: it expired or was accepted by another backend process",
+                response=status_response)
+        status_response.raise_for_status()
+
+        job = status_response.json()
+        if job.get("pagesTotal"):
+            progress_bar.progress(job["pagesDone"] / job["pagesTotal"],
+                                  text=f"Extracted {job['pagesDone']} of {job['pagesTotal']} pages")
+        if job["status"] in ["completed", "failed"]:
+            return job
+
+    raise requests.exceptions.Timeout("OCR job did not finish in time")
 
 # Streamlit UI
 st.title("OCR Document Upload")
@@ -26,11 +75,13 @@ if uploaded_file is not None:
         with st.spinner("Processing OCR..."):
             files = {"file": (uploaded_file.name, uploaded_file, "application/octet-stream")}
             try:
-                response = requests.post(BACKEND_URL, files=files, timeout=150)
-                response.raise_for_status()  # Raise error for HTTP failure
+                if USE_JOBS_FOR_PDFS and file_extension == "pdf":
+                    job = run_ocr_job(files, st.progress(0.0))
+                else:
+                    job = run_ocr_request(files)
 
-                if response.status_code == 200:
-                    extracted_data = response.json()
+                if job["status"] == "completed":
+                    extracted_data = job["result"]
 
                     if "error" in extracted_data:
                         st.error(f"Error: {extracted_data['error']}")
@@ -55,11 +106,22 @@ if uploaded_file is not None:
                         elif document_type == "Credence Document":
                             extracted_text_list = extracted_data.get("extractedData", [])
                             structured_data = {}
-                            candidate_photo = extracted_data.get("candidatePhotoPath", "")
+                            candidate_photo = extracted_data.get("candidatePhoto", "")
+                            if candidate_photo:
+                                # The backend sends the photo inline as a data URI
+                                st.image(base64.b64decode(candidate_photo.split(",", 1)[1]), caption="Candidate Photo")
 
                             if extracted_text_list:
                                 for page_data in extracted_text_list:
                                     raw_text = page_data.get("data", "")
+                                    if isinstance(raw_text, dict):
+                                        # Structured answer: labelled fields and headed sections
+                                        for field in raw_text.get("fields", []):
+                                            structured_data[field.get("label", "")] = field.get("value", "")
+                                        for section in raw_text.get("sections", []):
+                                            structured_data[section.get("heading", "")] = section.get("text", "")
+                                        continue
+
                                     lines = raw_text.split("\n")
                                     current_section = None
 
@@ -84,7 +146,7 @@ if uploaded_file is not None:
                                     "status": "success",
                                     "message": "OCR Extraction Completed",
                                     "documentType": "Credence Document",
-                                    "candidatePhotoPath": candidate_photo,
+                                    "candidatePhoto": candidate_photo,
                                     "data": structured_data
                                 }
                             else:
@@ -150,7 +212,7 @@ if uploaded_file is not None:
                             st.error("Invalid JSON format! Please check your edits.")
 
                 else:
-                    st.error(f"API request failed: {response.status_code}\n{response.text}")
+                    st.error(f"API request failed: {job['statusCode']}\n{job['result']}")
 
             except requests.exceptions.RequestException as e:
                 st.error(f"API request failed: {e}")
@@ -0,0 +1,97 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+from urllib3.exceptions import EmptyPoolError
+
+import ocr_backend_main_file as backend
+
+
+class TruncatedBodyHandler(BaseHTTPRequestHandler):
+    """Promises a 1000 byte body and closes the connection after 6 bytes."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Length", "1000")
+        self.end_headers()
+        self.wfile.write(b'{"resp')
+        self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = backend.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow_request())
+
+    def test_half_open_probe_success_closes(self):
+        breaker = backend.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, "half_open")
+        self.assertFalse(breaker.allow_request())  # Only one probe at a time
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertFalse(breaker.is_open())
+
+    def test_half_open_probe_failure_reopens(self):
+        breaker = backend.CircuitBreaker(failure_threshold=5, reset_timeout=0)
+        for _ in range(5):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+
+
+class MakeApiRequestBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), TruncatedBodyHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.saved = (backend.API_URL, backend.API_MAX_RETRIES, backend.api_circuit_breaker, backend.api_rate_limiter)
+        backend.API_URL = f"http://127.0.0.1:{self.server.server_port}/api/generate"
+        backend.API_MAX_RETRIES = 0
+        backend.api_rate_limiter = backend.TokenBucket(0, 1)
+
+    def tearDown(self):
+        backend.API_URL, backend.API_MAX_RETRIES, backend.api_circuit_breaker, backend.api_rate_limiter = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_truncated_body_on_probe_reopens_circuit(self):
+        breaker = backend.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        backend.api_circuit_breaker = breaker
+
+        with self.assertRaises(backend.ModelBackendUnavailable):
+            backend.make_api_request({"model": backend.MODEL_NAME, "prompt": "x"})
+        self.assertEqual(breaker.state, "open")
+
+    def test_exhausted_pool_is_not_a_failure(self):
+        breaker = backend.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        backend.api_circuit_breaker = breaker
+
+        with mock.patch.object(backend.api_session, "post", side_effect=EmptyPoolError(None, "Pool is empty.")):
+            with self.assertRaises(backend.ModelBackendUnavailable):
+                backend.make_api_request({"model": backend.MODEL_NAME, "prompt": "x"})
+            self.assertEqual(breaker.state, "closed")
+            self.assertEqual(breaker.failures, 0)
+
+            breaker.record_failure()
+            with self.assertRaises(backend.ModelBackendUnavailable):
+                backend.make_api_request({"model": backend.MODEL_NAME, "prompt": "x"})
+        self.assertEqual(breaker.state, "open")
+        self.assertTrue(breaker.allow_request())  # The unused probe is handed back
+
+
+if __name__ == "__main__":
+    unittest.main()
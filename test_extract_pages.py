@@ -0,0 +1,120 @@
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import ocr_backend_main_file as backend
+
+
+class ExtractPagesTest(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.yielded = 0
+        self.finished = 0
+        self.max_ahead = 0
+        self.patches = [
+            mock.patch.object(backend, "page_cache", backend.ResultCache(16)),
+            mock.patch.object(backend, "make_api_request", side_effect=self.answer),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def answer(self, payload):
+        time.sleep(random.uniform(0, 0.02))
+        with self.lock:
+            self.finished += 1
+        return backend.RebuiltResponse(200, {"response": payload["images"][0], "done_reason": "stop"})
+
+    def pages(self, count):
+        for i in range(count):
+            with self.lock:
+                self.yielded += 1
+                self.max_ahead = max(self.max_ahead, self.yielded - self.finished)
+            yield f"page {i + 1}"
+
+    def test_responses_in_page_order(self):
+        done = []
+        responses = backend.extract_pages(self.pages(12), "prompt", lambda i, response: done.append(i))
+        self.assertEqual([response.json()["response"] for response in responses],
+                         [f"page {i + 1}" for i in range(12)])
+        self.assertEqual(sorted(done), list(range(12)))
+
+    def test_rendering_stays_a_bounded_number_of_pages_ahead(self):
+        backend.extract_pages(self.pages(40), "prompt")
+        # The page waiting for a free slot has been yielded but not submitted yet
+        self.assertLessEqual(self.max_ahead, 2 * backend.MAX_CONCURRENT_PAGE_REQUESTS + 1)
+
+    def test_text_layer_pages_are_sent_as_text(self):
+        with mock.patch.object(backend, "make_api_request",
+                               return_value=backend.RebuiltResponse(200, {"response": "ok"})) as api:
+            backend.extract_pages([None, "page 2"], "prompt", page_texts=["Net Pay 100", None])
+        payloads = sorted((call.args[0] for call in api.call_args_list), key=lambda payload: "images" in payload)
+        self.assertEqual(payloads[0]["model"], backend.TEXT_MODEL_NAME)
+        self.assertIn("Net Pay 100", payloads[0]["prompt"])
+        self.assertEqual(payloads[1]["images"], ["page 2"])
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = backend.ResultCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_disk_tier_survives_a_new_cache(self):
+        with tempfile.TemporaryDirectory() as disk_dir:
+            backend.ResultCache(2, disk_dir, 1024 * 1024).put("key", {"body": "x"})
+            cache = backend.ResultCache(2, disk_dir, 1024 * 1024)
+            self.assertEqual(cache.get("key"), {"body": "x"})
+            self.assertEqual(cache.stats()["diskHits"], 1)
+
+    def test_disk_tier_is_size_capped(self):
+        with tempfile.TemporaryDirectory() as disk_dir:
+            cache = backend.ResultCache(10, disk_dir, 250)
+            for i in range(5):
+                cache.put(f"key{i}", "x" * 100)
+            self.assertLessEqual(sum(entry.stat().st_size for entry in os.scandir(disk_dir)), 250)
+
+
+class ClassificationIndexTest(unittest.TestCase):
+    PAGE_HASH = 0xFFFF0000FFFF0000
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "index.json")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def new_index(self):
+        return backend.ClassificationIndex(self.path, max_distance=0.1, max_entries=10)
+
+    def test_near_duplicate_pages_match(self):
+        index = self.new_index()
+        index.add(self.PAGE_HASH, "Pay Slip")
+        self.assertEqual(index.lookup(self.PAGE_HASH ^ 0b111), "Pay Slip")
+        self.assertIsNone(index.lookup(self.PAGE_HASH ^ 0x3FF))
+
+    def test_reloaded_from_disk(self):
+        self.new_index().add(self.PAGE_HASH, "Result")
+        self.assertEqual(self.new_index().lookup(self.PAGE_HASH), "Result")
+
+    def test_discarded_when_prompt_version_changes(self):
+        self.new_index().add(self.PAGE_HASH, "Result")
+        with mock.patch.object(backend, "PROMPT_VERSION", backend.PROMPT_VERSION + "-next"):
+            self.assertIsNone(self.new_index().lookup(self.PAGE_HASH))
+
+
+if __name__ == "__main__":
+    unittest.main()
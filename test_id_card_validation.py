@@ -0,0 +1,119 @@
+import io
+import json
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import ocr_backend_main_file as backend
+
+VALID_AADHAAR = {
+    "documentType": "Aadhaar card",
+    "documentNumber": "2345 6789 0124",
+    "dateOfBirthorIssue": "01/01/1990",
+    "FatherGuardianName": "C B",
+    "nameAsOnDoc": "A B",
+    "Gender": "पुरुष / MALE",
+    "Address": "Pune",
+}
+
+
+def model_answer(fields):
+    return backend.RebuiltResponse(200, {"response": json.dumps(fields), "done_reason": "stop"})
+
+
+class ValidatorTest(unittest.TestCase):
+    def test_verhoeff_accepts_valid_check_digit(self):
+        self.assertTrue(backend.is_valid_aadhaar_number("2345 6789 0124"))
+        self.assertTrue(backend.is_valid_aadhaar_number("2345-6789-0124"))
+        self.assertTrue(backend.is_valid_aadhaar_number("234567890124"))
+
+    def test_verhoeff_rejects_wrong_digits(self):
+        self.assertFalse(backend.is_valid_aadhaar_number("2345 6789 0125"))  # Check digit
+        self.assertFalse(backend.is_valid_aadhaar_number("2345 6789 0214"))  # Transposition
+        self.assertFalse(backend.is_valid_aadhaar_number("1345 6789 0124"))  # Never starts with 0 or 1
+        self.assertFalse(backend.is_valid_aadhaar_number("2345 6789 012"))
+        self.assertFalse(backend.is_valid_aadhaar_number("NA"))
+
+    def test_pan_number(self):
+        self.assertTrue(backend.is_valid_pan_number("ABCDE1234F"))
+        self.assertTrue(backend.is_valid_pan_number("abcde 1234 f"))
+        self.assertFalse(backend.is_valid_pan_number("ABCD12345F"))
+        self.assertFalse(backend.is_valid_pan_number("ABCDE1234"))
+
+    def test_date(self):
+        for value in ["01/01/1990", "1990-01-01", "5 March 1990", "1990"]:
+            self.assertTrue(backend.is_valid_date(value), value)
+        for value in ["31/02/1990", "1890", "NA"]:
+            self.assertFalse(backend.is_valid_date(value), value)
+
+    def test_gender(self):
+        self.assertTrue(backend.is_valid_gender("पुरुष / MALE"))
+        self.assertTrue(backend.is_valid_gender("Female"))
+        self.assertFalse(backend.is_valid_gender("NA"))
+
+    def test_present(self):
+        self.assertTrue(backend.is_present("A B"))
+        self.assertFalse(backend.is_present("Not Visible"))
+        self.assertFalse(backend.is_present("--"))
+
+
+class MergeIdCardResponsesTest(unittest.TestCase):
+    def test_prefers_first_valid_value(self):
+        samples = [
+            {**VALID_AADHAAR, "documentNumber": "2345 6789 0125", "Gender": "NA"},
+            {**VALID_AADHAAR, "nameAsOnDoc": "A. B."},
+        ]
+        merged = backend.merge_id_card_responses(samples, "Aadhaar Card")
+        self.assertEqual(merged["documentNumber"], "2345 6789 0124")
+        self.assertEqual(merged["Gender"], "पुरुष / MALE")
+        self.assertEqual(merged["nameAsOnDoc"], "A B")  # Both valid: the first sample wins
+        self.assertEqual(backend.invalid_id_card_fields(merged, "Aadhaar Card"), [])
+
+    def test_keeps_invalid_value_when_none_validates(self):
+        samples = [{"documentNumber": "2345 6789 0125"}, {"documentNumber": "N/A"}]
+        merged = backend.merge_id_card_responses(samples, "Aadhaar Card")
+        self.assertEqual(merged["documentNumber"], "2345 6789 0125")
+        self.assertEqual(merged["Address"], "NA")
+        self.assertIn("documentNumber", backend.invalid_id_card_fields(merged, "Aadhaar Card"))
+
+
+class IdCardSamplingTest(unittest.TestCase):
+    def setUp(self):
+        image = Image.new("RGB", (400, 250), "white")
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG")
+        self.upload = buffer.getvalue()
+        self.patches = [
+            mock.patch.object(backend, "ID_CARD_COMBINED_MODE", False),
+            mock.patch.object(backend, "SPECULATIVE_ID_CARD_EXTRACTION", False),
+            mock.patch.object(backend, "determine_document_type", return_value="Aadhaar Card"),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def test_stops_after_one_call_when_every_field_validates(self):
+        with mock.patch.object(backend, "make_api_request", return_value=model_answer(VALID_AADHAAR)) as api:
+            body, status_code = backend.extract_document(self.upload, "png")
+        self.assertEqual(status_code, 200)
+        self.assertEqual(api.call_count, 1)
+        self.assertEqual(body["documentNumber"], "2345 6789 0124")
+
+    def test_samples_again_for_failing_fields_only(self):
+        answers = [model_answer({**VALID_AADHAAR, "documentNumber": "2345 6789 0125"})]
+        answers += [model_answer({"documentNumber": "2345 6789 0124"})] * (backend.ID_CARD_SAMPLES - 1)
+        with mock.patch.object(backend, "make_api_request", side_effect=answers) as api:
+            body, status_code = backend.extract_document(self.upload, "png")
+        self.assertEqual(status_code, 200)
+        self.assertEqual(api.call_count, backend.ID_CARD_SAMPLES)
+        retry_payload = api.call_args_list[1].args[0]
+        self.assertEqual(list(retry_payload["format"]["properties"]), ["documentNumber"])
+        self.assertEqual(body["documentNumber"], "2345 6789 0124")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+import ocr_backend_main_file as backend
+
+PAYSLIP_TEXT = """ACME SERVICES PVT LTD
+Pay Slip for the month of June 2024
+Employee Name: A B          Employee Code: 1042
+PAN No.: ABCDE1234F         Aadhaar No: 2345 6789 0124
+BASIC 20,000.00   HRA 8,000.00
+Net Pay Amount: 26,500.00"""
+
+
+class ClassifyTextTest(unittest.TestCase):
+    def test_single_type(self):
+        self.assertEqual(backend.classify_text("Pay Slip for June\nNet Pay: 26,500"), "Pay Slip")
+        self.assertEqual(backend.classify_text("Government of India\nAADHAAR\n2345 6789 0124"), "Aadhaar Card")
+
+    def test_payslip_quoting_id_numbers_is_not_an_id_card(self):
+        self.assertIsNone(backend.classify_text(PAYSLIP_TEXT))
+
+    def test_marks_memo_quoting_pan_is_not_an_id_card(self):
+        text = "University of Pune\nHall Ticket No 1234\nPermanent Account Number of guardian: ABCDE1234F"
+        self.assertIsNone(backend.classify_text(text))
+
+    def test_credence_wins_over_quoted_ids(self):
+        text = "Credence background verification\nAadhaar No: 2345 6789 0124\nPAN: ABCDE1234F"
+        self.assertEqual(backend.classify_text(text), "Credence Document")
+
+    def test_no_keywords(self):
+        self.assertIsNone(backend.classify_text("Lorem ipsum dolor sit amet"))
+
+
+class PageRunsTest(unittest.TestCase):
+    def test_groups_consecutive_pages_up_to_max_length(self):
+        self.assertEqual(backend.page_runs([1, 2, 3, 5, 6, 9, 10, 11, 12, 13], 4),
+                         [[1, 3], [5, 6], [9, 12], [13, 13]])
+
+    def test_no_pages(self):
+        self.assertEqual(backend.page_runs([], 4), [])
+
+
+if __name__ == "__main__":
+    unittest.main()